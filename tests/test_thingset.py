@@ -1,3 +1,5 @@
+import pytest
+
 import thingset
 
 """
@@ -165,3 +167,179 @@ def test_encode_simple_message_raw_with_domain_dict():
     assert thingset_msg[0] == thingset.ThingsetFunction.PUBLICATION_MESSAGE.value
 
     assert thingset_msg.hex() == THINGSET_SIMPLE_MESSAGE.hex()
+
+
+def test_decode_message_with_unknown_function():
+    msg = bytes.fromhex("1E") + THINGSET_SIMPLE_MESSAGE[1:]
+
+    with pytest.raises(thingset.ParsingError):
+        thingset.decode_thingset_message(msg)
+
+
+def test_encode_message_raw_with_non_numeric_values_and_large_ids():
+    raw_msg_payload = {0x01: "v0.1.0", 0x4E: True, 0x7001: -854, 0x7002: 2.5}
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.Message(msg_function, raw_msg_payload)
+
+    thingset_msg = thingset.encode_thingset_message(msg)
+
+    assert thingset_msg == bytes.fromhex(
+        "1F"
+        "A4"
+        "01"
+        "66 76302E312E30"
+        "18 4E"
+        "F5"
+        "19 7001"
+        "39 0355"
+        "19 7002"
+        "FA 40200000"
+    )
+    assert thingset.decode_thingset_message(thingset_msg).payload == raw_msg_payload
+
+
+def test_encode_simple_message_raw_with_domain_dict_updated_between_messages():
+    domain_mapping = THINGSET_TEST_DOMAIN_MAPPING.copy()
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.MessageWithDomain(
+        msg_function, THINGSET_TEST_MSG_PAYLOAD_WITH_DOMAIN
+    )
+
+    thingset_msg = thingset.encode_thingset_message_with_domain(msg, domain_mapping)
+    assert thingset_msg.hex() == THINGSET_SIMPLE_MESSAGE.hex()
+
+    domain_mapping[0x3C] = "extraField"
+    msg = thingset.MessageWithDomain(
+        msg_function, {**THINGSET_TEST_MSG_PAYLOAD_WITH_DOMAIN, "extraField": 1}
+    )
+
+    thingset_msg = thingset.encode_thingset_message_with_domain(msg, domain_mapping)
+    decoded_msg = thingset.decode_thingset_message(thingset_msg, floats_precision=3)
+    assert decoded_msg.payload == {**THINGSET_TEST_MSG_PAYLOAD_RAW, 0x3C: 1}
+
+
+def test_encode_message_with_domain_dict_mutated_in_place_without_changing_its_size():
+    domain_mapping = {0x01: "a", 0x02: "b"}
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.MessageWithDomain(msg_function, {"a": 1})
+
+    thingset_msg = thingset.encode_thingset_message_with_domain(msg, domain_mapping)
+    assert thingset_msg == bytes.fromhex("1F" "A1" "01" "01")
+
+    domain_mapping[0x01] = "c"
+    del domain_mapping[0x02]
+    domain_mapping[0x02] = "a"
+
+    thingset_msg = thingset.encode_thingset_message_with_domain(msg, domain_mapping)
+    assert thingset_msg == bytes.fromhex("1F" "A1" "02" "01")
+
+
+def test_encode_messages_with_same_domain_dict_reuses_flipped_mapping():
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.MessageWithDomain(
+        msg_function, THINGSET_TEST_MSG_PAYLOAD_WITH_DOMAIN
+    )
+
+    for _ in range(2):
+        thingset_msg = thingset.encode_thingset_message_with_domain(
+            msg, THINGSET_TEST_DOMAIN_MAPPING
+        )
+        assert thingset_msg.hex() == THINGSET_SIMPLE_MESSAGE.hex()
+
+    assert thingset._get_flipped_domain_mapping(
+        THINGSET_TEST_DOMAIN_MAPPING
+    ) is thingset._get_flipped_domain_mapping(THINGSET_TEST_DOMAIN_MAPPING)
+
+
+def test_encode_messages_with_more_domain_dicts_than_the_cache_size():
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.MessageWithDomain(msg_function, {"field": 1})
+    domain_mappings = [
+        {raw_key: "field"}
+        for raw_key in range(1, thingset._FLIPPED_DOMAIN_MAPPINGS_CACHE_MAX_SIZE + 3)
+    ]
+
+    for _ in range(2):
+        for domain_mapping in domain_mappings:
+            raw_key = next(iter(domain_mapping))
+            thingset_msg = thingset.encode_thingset_message_with_domain(
+                msg, domain_mapping
+            )
+            assert thingset_msg == bytes((0x1F, 0xA1, raw_key, 0x01))
+
+    assert (
+        len(thingset._FLIPPED_DOMAIN_MAPPINGS_CACHE)
+        <= thingset._FLIPPED_DOMAIN_MAPPINGS_CACHE_MAX_SIZE
+    )
+
+
+def test_decode_simple_message_raw_from_bytes_like_objects():
+    for msg in (
+        bytearray(THINGSET_SIMPLE_MESSAGE),
+        memoryview(THINGSET_SIMPLE_MESSAGE),
+    ):
+        decoded_msg = thingset.decode_thingset_message(msg, floats_precision=3)
+
+        assert decoded_msg.function == thingset.ThingsetFunction.PUBLICATION_MESSAGE
+
+        assert decoded_msg.payload == THINGSET_TEST_MSG_PAYLOAD_RAW
+
+
+def test_decode_batch_of_messages_raw():
+    other_msg = bytes.fromhex("01" "A1" "09" "18 52")
+
+    decoded_msgs = thingset.decode_thingset_messages(
+        [THINGSET_SIMPLE_MESSAGE, other_msg, memoryview(THINGSET_SIMPLE_MESSAGE)],
+        floats_precision=3,
+    )
+
+    assert decoded_msgs == [
+        thingset.Message(
+            thingset.ThingsetFunction.PUBLICATION_MESSAGE, THINGSET_TEST_MSG_PAYLOAD_RAW
+        ),
+        thingset.Message(thingset.ThingsetFunction.READ, {0x09: 82}),
+        thingset.Message(
+            thingset.ThingsetFunction.PUBLICATION_MESSAGE, THINGSET_TEST_MSG_PAYLOAD_RAW
+        ),
+    ]
+    assert all(isinstance(msg, thingset.Message) for msg in decoded_msgs)
+
+
+def test_decode_batch_of_messages_with_invalid_message():
+    invalid_msg = bytes.fromhex("1F" "82" "01" "02")
+
+    with pytest.raises(thingset.ParsingError):
+        thingset.decode_thingset_messages([THINGSET_SIMPLE_MESSAGE, invalid_msg])
+
+
+def test_encode_message_raw_with_only_float_values():
+    raw_msg_payload = {0x07: 123.0, 0x08: 15.2}
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.Message(msg_function, raw_msg_payload)
+
+    thingset_msg = thingset.encode_thingset_message(msg)
+
+    assert thingset_msg == bytes.fromhex(
+        "1F" "A2" "07" "FA 42f60000" "08" "FA 41733333"
+    )
+
+
+def test_encode_message_raw_with_only_numeric_values():
+    raw_msg_payload = {0x01: -1, 0x7001: 2 ** 40, 0x4E: 15.2, 0x09: -854}
+    msg_function = thingset.ThingsetFunction.PUBLICATION_MESSAGE
+    msg = thingset.Message(msg_function, raw_msg_payload)
+
+    thingset_msg = thingset.encode_thingset_message(msg)
+
+    assert thingset_msg == bytes.fromhex(
+        "1F"
+        "A4"
+        "01"
+        "20"
+        "19 7001"
+        "1B 0000010000000000"
+        "18 4E"
+        "FA 41733333"
+        "09"
+        "39 0355"
+    )
@@ -13,11 +13,13 @@
 #  * We also have to manually build the CBOR map, as the C implementation of the Nodes firmware forces floats to all
 #    be encoded following the "float32" format (which is not the case of our Python implementation).
 #
-from io import BytesIO
 import enum
+import functools
+import struct
 import typing as t
 
-import cbor2
+# (cbor2 v5+ already picks its optional C extension by itself when it's available - cbor2 v4 is pure-Python)
+from cbor2 import dumps as _cbor_dumps, loads as _cbor_loads
 
 __version__ = "0.1.0"
 
@@ -25,6 +27,8 @@ __version__ = "0.1.0"
 MessagePayload = t.Dict[int, t.Any]
 MessagePayloadWithDomain = t.Dict[str, t.Any]
 PayloadDomainMapping = t.Dict[int, str]
+# (binary ThingSet messages can be decoded from any bytes-like object, without having to copy them first)
+MessageBuffer = t.Union[bytes, bytearray, memoryview]
 
 
 class ThingsetFunction(enum.Enum):
@@ -39,6 +43,17 @@ class ThingsetFunction(enum.Enum):
     PUBLICATION_MESSAGE = 0x1F
 
 
+_FUNCTION_BY_VALUE: t.Dict[int, ThingsetFunction] = {
+    protocol_function.value: protocol_function for protocol_function in ThingsetFunction
+}
+
+
+_FLIPPED_DOMAIN_MAPPINGS_CACHE: t.Dict[
+    int, t.Tuple[PayloadDomainMapping, PayloadDomainMapping, t.Dict[str, int]]
+] = {}
+_FLIPPED_DOMAIN_MAPPINGS_CACHE_MAX_SIZE = 8
+
+
 class Message(t.NamedTuple):
     function: ThingsetFunction
     payload: MessagePayload
@@ -53,15 +68,48 @@ class ParsingError(Exception):
     pass
 
 
-def decode_thingset_message(msg: bytes, *, floats_precision: int = None) -> Message:
-    function = _parse_thingset_msg_function(msg)
-    payload = _parse_thingset_msg_payload(msg, floats_precision)
+# Our decoded messages are built with `tuple.__new__()` rather than by calling the NamedTuples: this skips
+# the arguments handling of their generated `__new__()` method, which is quite slow in comparison.
+_new_tuple = tuple.__new__
+
 
-    return Message(function=function, payload=payload)
+def decode_thingset_message(
+    msg: MessageBuffer, *, floats_precision: int = None
+) -> Message:
+    function, payload = _parse_thingset_msg(msg, floats_precision)
+
+    return _new_tuple(Message, (function, payload))
+
+
+def decode_thingset_messages(
+    msgs: t.Iterable[MessageBuffer], *, floats_precision: int = None
+) -> t.List[Message]:
+    """
+    Same as `decode_thingset_message()`, but for a whole batch of messages (all the frames received from a
+    CAN bus in one go for example): the lookups we need for each message are done once for the whole batch.
+    """
+    functions_by_value = _FUNCTION_BY_VALUE
+    cbor_loads = _cbor_loads
+    new_tuple = _new_tuple
+    message_class = Message
+
+    decoded_msgs: t.List[Message] = []
+    append_decoded_msg = decoded_msgs.append
+    for msg in msgs:
+        function = functions_by_value.get(msg[0])
+        payload = cbor_loads(memoryview(msg)[1:]) if function is not None else None
+        if type(payload) is not dict:
+            # (let's have our regular message parsing raise the appropriate ParsingError)
+            function, payload = _parse_thingset_msg(msg)
+        if floats_precision is not None:
+            payload = _round_payload_floats(payload, floats_precision)
+        append_decoded_msg(new_tuple(message_class, (function, payload)))
+
+    return decoded_msgs
 
 
 def decode_thingset_message_with_domain(
-    msg: bytes,
+    msg: MessageBuffer,
     payload_key_mapping: PayloadDomainMapping,
     *,
     floats_precision: int = None,
@@ -87,87 +135,207 @@ def decode_thingset_message_with_domain(
         }
     ```
     """
-    function = _parse_thingset_msg_function(msg)
-    raw_payload = _parse_thingset_msg_payload(msg, floats_precision)
+    function, raw_payload = _parse_thingset_msg(msg, floats_precision)
 
+    # (we iterate over the payload rather than over the mapping, which can be much larger than the msg)
     domain_payload: MessagePayloadWithDomain = {
-        domain_key: raw_payload[raw_key]
-        for raw_key, domain_key in payload_key_mapping.items()
-        if raw_key in raw_payload
+        payload_key_mapping[raw_key]: value
+        for raw_key, value in raw_payload.items()
+        if raw_key in payload_key_mapping
     }
 
-    return MessageWithDomain(function=function, payload=domain_payload)
+    return _new_tuple(MessageWithDomain, (function, domain_payload))
 
 
 def encode_thingset_message(msg: Message) -> bytes:
-    from cbor2.encoder import encode_length
+    payload = msg.payload
+    items_count = len(payload)
+
+    # Fast path for messages only made of floats with 1 byte Data Object IDs (i.e. most telemetry messages):
+    # they have a fixed binary layout, so we can pack the whole message with a single `struct` call.
+    if items_count < 24:
+        packed_values = [msg.function.value, 0xA0 | items_count]
+        add_packed_values = packed_values.extend
+        for key, value in payload.items():
+            if type(value) is not float or type(key) is not int or not 0 <= key < 24:
+                break
+            add_packed_values((key, 0xFA, value))
+        else:
+            return _get_floats_message_struct(items_count).pack(*packed_values)
+
+    return _encode_message(msg.function, payload.items(), items_count)
+
+
+def encode_thingset_message_with_domain(
+    msg: MessageWithDomain, payload_key_mapping: PayloadDomainMapping
+) -> bytes:
+    # Domain keys are translated to raw Data Object IDs (short integers rather than domain strings) on the fly,
+    # while the items are encoded - so we don't have to build a whole "raw payload" dict first.
+    flipped_domain_mapping = _get_flipped_domain_mapping(payload_key_mapping)
+    raw_items = (
+        (flipped_domain_mapping[key], value) for key, value in msg.payload.items()
+    )
+
+    return _encode_message(msg.function, raw_items, len(msg.payload))
 
-    result = BytesIO()
+
+def _encode_message(
+    function: ThingsetFunction,
+    items: t.Iterable[t.Tuple[t.Any, t.Any]],
+    items_count: int,
+) -> bytes:
+    # We write everything in a single buffer, big enough for the worst case of each item: a 3 bytes
+    # Data Object ID and a 9 bytes value. Whatever doesn't fit in that budget (values we let cbor2 encode,
+    # unusual Data Object IDs...) is inserted in that buffer rather than written on top of it.
+    buf = bytearray(1 + 9 + 12 * items_count)
 
     # ThingSet first byte:
-    result.write(msg.function.value.to_bytes(1, byteorder="little"))
+    buf[0] = function.value
     # CBOR map marker:
-    result.write(encode_length(0xA0, len(msg.payload)))
-
-    encoder = cbor2.encoder.CBOREncoder(result)
-    for key, value in msg.payload.items():
-        encoder.encode(key)
-        if isinstance(value, float):
-            _encode_float_using_float32(result, value)
+    offset = _encode_length(buf, 1, 0xA0, items_count)
+
+    for key, value in items:
+        if type(key) is not int:
+            offset = _encode_with_cbor2(buf, offset, key)
+        elif 0 <= key < 24:
+            buf[offset] = key
+            offset += 1
         else:
-            encoder.encode(value)
+            offset = _encode_small_uint(buf, offset, key)
+        offset = _VALUE_ENCODERS.get(type(value), _encode_other_value)(
+            buf, offset, value
+        )
 
-    return result.getvalue()
+    # (truncating the buffer in place rather than slicing it saves us an intermediate copy of the msg)
+    del buf[offset:]
+    return bytes(buf)
 
 
-def encode_thingset_message_with_domain(
-    msg: MessageWithDomain, payload_key_mapping: PayloadDomainMapping
-) -> bytes:
-    # We just create a "raw_payload" (where keys are short integers rather than domain strings) by
-    # mapping the Domain-ish dct we get to a raw one, and then we call `encode_thingset_message()`.
+def _get_flipped_domain_mapping(
+    payload_key_mapping: PayloadDomainMapping
+) -> t.Dict[str, int]:
+    # Domain mappings are usually module-level constants, so rather than flipping them for every message
+    # we cache the flipped version - keyed by the id() of the mapping, which we keep a reference to in order
+    # to make sure that this id is not reused by another dict.
+    # A snapshot of the mapping is cached as well, so that a mapping mutated in place is flipped again: comparing
+    # two dicts is done in C, and is still much cheaper than flipping the mapping again.
+    mapping_id = id(payload_key_mapping)
+    cached = _FLIPPED_DOMAIN_MAPPINGS_CACHE.get(mapping_id)
+    if cached is not None and cached[1] == payload_key_mapping:
+        return cached[2]
+
     flipped_domain_mapping: t.Dict[str, int] = {
         value: key for key, value in payload_key_mapping.items()
     }
-    payload_raw = {
-        flipped_domain_mapping[key]: value for key, value in msg.payload.items()
-    }
-    msg_raw = Message(msg.function, payload_raw)
+    if len(_FLIPPED_DOMAIN_MAPPINGS_CACHE) >= _FLIPPED_DOMAIN_MAPPINGS_CACHE_MAX_SIZE:
+        _FLIPPED_DOMAIN_MAPPINGS_CACHE.clear()
+    _FLIPPED_DOMAIN_MAPPINGS_CACHE[mapping_id] = (
+        payload_key_mapping,
+        dict(payload_key_mapping),
+        flipped_domain_mapping,
+    )
 
-    return encode_thingset_message(msg_raw)
+    return flipped_domain_mapping
 
 
-def _parse_thingset_msg_function(msg: bytes) -> ThingsetFunction:
+def _parse_thingset_msg(
+    msg: MessageBuffer, floats_precision: int = None
+) -> t.Tuple[ThingsetFunction, MessagePayload]:
     function_byte = msg[0]
-    for protocol_function in ThingsetFunction:
-        if protocol_function.value == function_byte:
-            return protocol_function
-    raise ParsingError(f"Thingset function '{function_byte}' is not implemented")
-
-
-def _parse_thingset_msg_payload(
-    msg: bytes, floats_precision: int = None
-) -> MessagePayload:
+    try:
+        function = _FUNCTION_BY_VALUE[function_byte]
+    except KeyError:
+        raise ParsingError(
+            f"Thingset function '{function_byte}' is not implemented"
+        ) from None
 
-    # (we ditch the ThingSet byte before decoding the msg with CBOR)
-    cbor_msg = msg[1:]
-    raw_payload: dict = cbor2.loads(cbor_msg)
+    # (we ditch the ThingSet byte before decoding the msg with CBOR - the memoryview saves us a copy of the msg)
+    cbor_msg = memoryview(msg)[1:]
+    raw_payload: dict = _cbor_loads(cbor_msg)
 
     if not isinstance(raw_payload, dict):
         raise ParsingError(
             f"ThingSet payload should be a dict, got {type(raw_payload)} instead"
         )
 
-    payload = {}
-    for data_object_id, value in raw_payload.items():
-        if floats_precision is not None and isinstance(value, float):
-            value = round(value, floats_precision)
+    if floats_precision is None:
+        return function, raw_payload
 
-        payload[data_object_id] = value
+    return function, _round_payload_floats(raw_payload, floats_precision)
 
-    return payload
 
+def _round_payload_floats(
+    raw_payload: MessagePayload, floats_precision: int
+) -> MessagePayload:
+    # (the CBOR decoder only gives us plain floats, so a `type()` check is enough here)
+    _round = round
+    _float = float
+    return {
+        data_object_id: _round(value, floats_precision)
+        if type(value) is _float
+        else value
+        for data_object_id, value in raw_payload.items()
+    }
 
-def _encode_float_using_float32(target: BytesIO, value: float) -> None:
+
+# Binary layouts of the CBOR items we encode by ourselves (compiled once, rather than on every call),
+# bound to module-level names so that we don't have to look their `pack_into()` method up every time:
+_pack_cbor_head_uint8 = struct.Struct(">BB").pack_into
+_pack_cbor_head_uint16 = struct.Struct(">BH").pack_into
+_pack_cbor_head_uint32 = struct.Struct(">BI").pack_into
+_pack_cbor_head_uint64 = struct.Struct(">BQ").pack_into
+_pack_cbor_float32 = struct.Struct(">Bf").pack_into
+
+
+@functools.lru_cache(maxsize=None)
+def _get_floats_message_struct(items_count: int) -> struct.Struct:
+    # ThingSet first byte, CBOR map marker, and then a Data Object ID and a CBOR_FLOAT32 for each item:
+    return struct.Struct(">BB" + "BBf" * items_count)
+
+
+def _encode_length(buf: bytearray, offset: int, major_tag: int, length: int) -> int:
+    # Same as cbor2's "encode_length()", but writing directly in our buffer.
+    if length < 24:
+        buf[offset] = major_tag | length
+        return offset + 1
+    elif length < 0x100:
+        _pack_cbor_head_uint8(buf, offset, major_tag | 24, length)
+        return offset + 2
+    elif length < 0x10000:
+        _pack_cbor_head_uint16(buf, offset, major_tag | 25, length)
+        return offset + 3
+    elif length < 0x100000000:
+        _pack_cbor_head_uint32(buf, offset, major_tag | 26, length)
+        return offset + 5
+    else:
+        _pack_cbor_head_uint64(buf, offset, major_tag | 27, length)
+        return offset + 9
+
+
+def _encode_small_uint(buf: bytearray, offset: int, n: int) -> int:
+    # Data Object IDs are small unsigned ints, which never take more than 2 bytes in practice.
+    # (the 1 byte IDs, below 24, are directly written by `_encode_message()`)
+    if n < 0:
+        return _encode_with_cbor2(buf, offset, n)
+    elif n < 0x100:
+        _pack_cbor_head_uint8(buf, offset, 0x18, n)
+        return offset + 2
+    elif n < 0x10000:
+        _pack_cbor_head_uint16(buf, offset, 0x19, n)
+        return offset + 3
+    return _encode_with_cbor2(buf, offset, n)
+
+
+def _encode_int(buf: bytearray, offset: int, value: int) -> int:
+    if 0 <= value < 0x10000000000000000:
+        return _encode_length(buf, offset, 0x00, value)
+    elif -0x10000000000000000 <= value < 0:
+        return _encode_length(buf, offset, 0x20, -1 - value)
+    # (CBOR bignums)
+    return _encode_with_cbor2(buf, offset, value)
+
+
+def _encode_float_using_float32(buf: bytearray, offset: int, value: float) -> int:
     # The messages produced by the C code of the nodes always use CBOR_FLOAT32, but the Python
     # implementation of the CBOR we use actually tries to be too smart for us:
     #  * It can either always use CBOR_FLOAT64, for any value of the floats
@@ -179,7 +347,26 @@ def _encode_float_using_float32(target: BytesIO, value: float) -> None:
     #
     # So the safer way to proceed is to copy those 3 lines of code from the "cbor2" package, which are responsible
     # for encoding in CBOR_FLOAT32, and force that encoding on our Python side as well.
-    import struct
+    _pack_cbor_float32(buf, offset, 0xFA, value)
+    return offset + 5
+
+
+def _encode_other_value(buf: bytearray, offset: int, value: t.Any) -> int:
+    # (subclasses of float - such as NumPy's "float64" - must be encoded as CBOR_FLOAT32 as well)
+    if isinstance(value, float):
+        return _encode_float_using_float32(buf, offset, value)
+    return _encode_with_cbor2(buf, offset, value)
+
+
+def _encode_with_cbor2(buf: bytearray, offset: int, value: t.Any) -> int:
+    # Slow path, for everything we don't encode by ourselves: the CBOR produced by cbor2 is inserted at
+    # the current offset, so that we keep all the room we reserved for the next items of the message.
+    encoded = _cbor_dumps(value)
+    buf[offset:offset] = encoded
+    return offset + len(encoded)
+
 
-    encoded = struct.pack(">Bf", 0xFA, value)
-    target.write(encoded)
+_VALUE_ENCODERS: t.Dict[type, t.Callable[[bytearray, int, t.Any], int]] = {
+    int: _encode_int,
+    float: _encode_float_using_float32,
+}